@@ -1,8 +1,13 @@
+import json
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
-from datetime import datetime, date, time, timedelta, timezone
+from datetime import datetime, date, timedelta, timezone
 import sys
-from urllib import request, error
+import time
+from typing import NamedTuple
+from urllib import parse
 
 PRIMARY_URL = "https://czq.rth1.xyz/time"
 FALLBACK_URL = "https://r.jina.ai/" + PRIMARY_URL
@@ -14,7 +19,15 @@ HEADERS = {
     ),
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
     "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
 }
+FETCH_TARGETS = [
+    ("primary", parse.urlsplit(PRIMARY_URL)),
+    ("fallback", parse.urlsplit(FALLBACK_URL)),
+]
+MAX_REDIRECTS = 5
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "czq_weekend"
+CACHE_META_PATH = CACHE_DIR / "meta.json"
 DAY_CONFIG = {
     "\u5468\u4e94": ("Friday", 4),
     "\u5468\u516d": ("Saturday", 5),
@@ -22,42 +35,232 @@ DAY_CONFIG = {
 }
 
 TIME_RANGE_RE = re.compile(r"(\d{1,2}:\d{2})\s*[\-~\u2013]\s*(\d{1,2}:\d{2})")
+_WEEK_TOKEN_SPLIT_RE = re.compile(r"[,\uFF0C\u3001]")
+_WEEK_RANGE_RE = re.compile(r"(\d{1,2})\s*[-~\u2013]\s*(\d{1,2})")
+_DIGITS_RE = re.compile(r"\d+")
+# RFC 5545 content lines are CRLF-terminated.
+_VCAL_HEAD = "\r\n".join([
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//CodexAgent//CZQ Weekend//EN",
+    "NAME:{name}",
+    "X-WR-CALNAME:{name}",
+    "CALSCALE:GREGORIAN",
+    "X-WR-TIMEZONE:Asia/Shanghai",
+    "BEGIN:VTIMEZONE",
+    "TZID:Asia/Shanghai",
+    "X-LIC-LOCATION:Asia/Shanghai",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0800",
+    "TZOFFSETTO:+0800",
+    "TZNAME:CST",
+    "DTSTART:19700101T000000",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+])
+_VEVENT_TMPL = "\r\n".join([
+    "BEGIN:VEVENT",
+    "UID:{uid}",
+    "DTSTAMP:{stamp}",
+    "SUMMARY:{summary}",
+    "DTSTART;TZID=Asia/Shanghai:{start}",
+    "DTEND;TZID=Asia/Shanghai:{end}",
+    "RRULE:FREQ=WEEKLY",
+    "DESCRIPTION:Source {url}",
+    "END:VEVENT",
+])
+_WEEK_SECTION_MARKER = "\u672c\u5468\u5b89\u6392"
+# One match per weekday bullet in the week section: group 1 is the bullet
+# text and group 2 the day marker. Tables are scanned from the text between
+# consecutive matches.
+_SECTION_RE = re.compile(
+    r"^[^\S\n]*\*([^\n]*?(" + "|".join(map(re.escape, DAY_CONFIG)) + r")[^\n]*)",
+    re.MULTILINE,
+)
+
+class Event(NamedTuple):
+    uid: str
+    summary: str
+    start: str
+    end: str
+
+
+@lru_cache(maxsize=1)
+def _ssl_context():
+    import ssl
+
+    return ssl.create_default_context()
+
+
+def _request_path(parts) -> str:
+    path = parts.path or "/"
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def _open_connection(parts):
+    """Open an HTTPS connection, tunnelling through the https proxy if configured."""
+    import base64
+    import http.client
+    from urllib import request
+
+    proxy = request.getproxies().get("https")
+    if not proxy or request.proxy_bypass(parts.hostname):
+        return http.client.HTTPSConnection(parts.netloc, timeout=30, context=_ssl_context())
+    proxy_parts = parse.urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    default_port = 443 if proxy_parts.scheme == "https" else 80
+    conn = http.client.HTTPSConnection(
+        proxy_parts.hostname, proxy_parts.port or default_port, timeout=30, context=_ssl_context()
+    )
+    tunnel_headers = {}
+    if proxy_parts.username:
+        credentials = f"{parse.unquote(proxy_parts.username)}:{parse.unquote(proxy_parts.password or '')}"
+        tunnel_headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+    conn.set_tunnel(parts.hostname, parts.port, headers=tunnel_headers)
+    return conn
+
+
+def _get(connections, parts, headers=HEADERS):
+    """Issue a GET over a cached keep-alive connection, following redirects.
+
+    Returns ``(status, headers, body)`` for 200 and 304 responses.
+    """
+    from urllib import error
+
+    for _ in range(MAX_REDIRECTS + 1):
+        conn = connections.get(parts.netloc)
+        if conn is None:
+            conn = _open_connection(parts)
+            connections[parts.netloc] = conn
+        try:
+            conn.request("GET", _request_path(parts), headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except Exception:
+            connections.pop(parts.netloc).close()
+            raise
+        location = resp.getheader("Location")
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            parts = parse.urlsplit(parse.urljoin(parts.geturl(), location))
+            if parts.scheme != "https":
+                raise error.HTTPError(parts.geturl(), resp.status, "Refusing non-HTTPS redirect", resp.headers, None)
+            continue
+        if resp.status not in (200, 304):
+            raise error.HTTPError(parts.geturl(), resp.status, resp.reason, resp.headers, None)
+        return resp.status, resp.headers, body
+    raise error.HTTPError(parts.geturl(), resp.status, "Too many redirects", resp.headers, None)
+
+
+def _load_cache_meta():
+    try:
+        meta = json.loads(CACHE_META_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _conditional_headers(entry):
+    """Add cache validators to HEADERS when a cached body is available.
+
+    Returns HEADERS itself when no validator was added.
+    """
+    if not isinstance(entry, dict):
+        return HEADERS
+    body_path = entry.get("body_path")
+    if not isinstance(body_path, str) or not Path(body_path).is_file():
+        return HEADERS
+    validators = {}
+    if isinstance(entry.get("etag"), str):
+        validators["If-None-Match"] = entry["etag"]
+    if isinstance(entry.get("last_modified"), str):
+        validators["If-Modified-Since"] = entry["last_modified"]
+    if not validators:
+        return HEADERS
+    return {**HEADERS, **validators}
+
+
+def _store_cache(meta, label, resp_headers, body: bytes):
+    etag = resp_headers.get("ETag")
+    last_modified = resp_headers.get("Last-Modified")
+    if not (etag or last_modified):
+        return
+    body_path = CACHE_DIR / f"{label}.body"
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _write_atomic(body_path, body)
+        meta[label] = {"etag": etag, "last_modified": last_modified, "body_path": str(body_path)}
+        _write_atomic(CACHE_META_PATH, json.dumps(meta).encode("utf-8"))
+    except OSError:  # pragma: no cover - cache is best effort
+        pass
+
 
 def fetch_content():
     """Attempt to fetch the schedule page, falling back via Jina if needed."""
-    attempts = [("primary", PRIMARY_URL), ("fallback", FALLBACK_URL)]
+    from urllib import error
+
+    connections = {}
+    meta = _load_cache_meta()
     last_exc = None
-    for label, url in attempts:
-        try:
-            req = request.Request(url, headers=HEADERS)
-            with request.urlopen(req, timeout=30) as resp:
-                body = resp.read().decode("utf-8", errors="ignore")
-            return body, label
-        except error.HTTPError as exc:
-            last_exc = exc
-            if exc.code == 403 and url != FALLBACK_URL:
-                continue
-        except Exception as exc:  # pragma: no cover - network failures
-            last_exc = exc
+    try:
+        for label, parts in FETCH_TARGETS:
+            entry = meta.get(label)
+            headers = _conditional_headers(entry)
+            try:
+                status, resp_headers, body = _get(connections, parts, headers)
+                if status == 304:
+                    if headers is HEADERS:
+                        raise error.HTTPError(
+                            parts.geturl(), status, "Unexpected 304 without a cached body", resp_headers, None
+                        )
+                    body = Path(entry["body_path"]).read_bytes()
+                else:
+                    _store_cache(meta, label, resp_headers, body)
+                return body.decode("utf-8", errors="ignore"), label
+            except error.HTTPError as exc:
+                last_exc = exc
+                if exc.code == 403 and label != "fallback":
+                    continue
+            except Exception as exc:  # pragma: no cover - network failures
+                last_exc = exc
+    finally:
+        for conn in connections.values():
+            conn.close()
     raise RuntimeError(f"Unable to fetch schedule: {last_exc}")
 
 def extract_time_ranges(text: str, current_week: int | None = None):
     """Extract time ranges for weekend training sessions."""
     time_map = {}
-    normalized_lines = [line.strip().replace("\uff1a", ":") for line in text.splitlines()]
-    in_week_section = False
-    pending_day = None
-    pending_rows = []
-
-    def parse_week_spec(spec: str):
+    marker = text.find(_WEEK_SECTION_MARKER)
+    if marker < 0:
+        return time_map
+    section_start = text.find("\n", marker)
+    if section_start < 0:
+        return time_map
+    text = text[section_start + 1:].translate({0xFF1A: 0x3A})
+    _spec_cache = {}
+
+    def parse_week_spec(
+        spec: str,
+        _split=_WEEK_TOKEN_SPLIT_RE.split,
+        _match_range=_WEEK_RANGE_RE.match,
+        _find_digits=_DIGITS_RE.findall,
+    ):
+        cached = _spec_cache.get(spec)
+        if cached is not None:
+            return cached
         weeks = set()
-        tokens = re.split(r"[,\uFF0C\u3001]", spec)
+        tokens = _split(spec)
         for token in tokens:
             token = token.strip()
             if not token:
                 continue
             token = token.replace("\u5468", "")
-            range_match = re.match(r"(\d{1,2})\s*[-~\u2013]\s*(\d{1,2})", token)
+            range_match = _match_range(token)
             if range_match:
                 start_week, end_week = map(int, range_match.groups())
                 if start_week <= end_week:
@@ -65,8 +268,10 @@ def extract_time_ranges(text: str, current_week: int | None = None):
                 else:
                     weeks.update(range(end_week, start_week + 1))
                 continue
-            for number in re.findall(r"\d+", token):
+            for number in _find_digits(token):
                 weeks.add(int(number))
+        weeks = frozenset(weeks)
+        _spec_cache[spec] = weeks
         return weeks
 
     def choose_table_time(rows):
@@ -80,80 +285,72 @@ def extract_time_ranges(text: str, current_week: int | None = None):
                 return start, end
         return None
 
-    def finalize_table():
-        nonlocal pending_day, pending_rows
-        if pending_day and pending_rows:
-            chosen = choose_table_time(pending_rows)
-            if chosen:
-                time_map[pending_day] = chosen
-        pending_day = None
-        pending_rows = []
-
-    for line in normalized_lines:
-        if not in_week_section and "\u672c\u5468\u5b89\u6392" in line:
-            in_week_section = True
-            continue
-        if not in_week_section:
-            continue
-
-        if pending_day and pending_rows and line and not line.startswith("|"):
-            finalize_table()
-
-        if pending_day and line.startswith("|"):
-            cells = [cell.strip() for cell in line.strip("|").split("|")]
-            if len(cells) >= 2 and not all(cell.strip("- ") == "" for cell in cells[:2]):
+    def table_time(segment: str):
+        # First table with time rows wins; blank lines, prose and bullets
+        # without a weekday may sit before it, and it ends at the next
+        # non-table line.
+        rows = []
+        for line in segment.split("\n"):
+            line = line.strip()
+            if line.startswith("|"):
+                cells = [cell.strip() for cell in line.strip("|").split("|")]
+                if len(cells) < 2 or ":" not in cells[1]:
+                    continue
                 time_match = TIME_RANGE_RE.search(cells[1])
                 if time_match:
-                    pending_rows.append((cells[0], time_match.group(1), time_match.group(2)))
-            continue
+                    rows.append((cells[0], time_match.group(1), time_match.group(2)))
+            elif line and rows:
+                break
+        return choose_table_time(rows) if rows else None
 
-        if pending_day and not line:
-            continue
+    def resolve(day, segment):
+        chosen = table_time(segment)
+        if chosen:
+            time_map[day] = chosen
 
-        if not line or not line.startswith("*"):
-            continue
+    pending = None
+    for section_match in _SECTION_RE.finditer(text):
+        if pending:
+            resolve(pending[0], text[pending[1]:section_match.start()])
+            pending = None
 
-        matched_day = None
+        line, matched_day = section_match.groups()
         for day in DAY_CONFIG:
+            if day == matched_day:
+                break
             if day in line:
                 matched_day = day
                 break
-        if matched_day is None:
-            continue
 
         time_match = TIME_RANGE_RE.search(line)
         if time_match:
             time_map[matched_day] = (time_match.group(1), time_match.group(2))
-            pending_day = None
-            pending_rows = []
         else:
-            pending_day = matched_day
-            pending_rows = []
+            pending = (matched_day, section_match.end())
 
         if len(time_map) == len(DAY_CONFIG):
+            pending = None
             break
 
-    if pending_day and pending_rows:
-        finalize_table()
+    if pending:
+        resolve(pending[0], text[pending[1]:])
 
     return time_map
 
 
 
-def parse_clock(clock_str: str) -> time:
+def parse_clock(clock_str: str) -> tuple[int, int]:
     hour, minute = map(int, clock_str.split(":"))
-    return time(hour=hour, minute=minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid clock time: {clock_str!r}")
+    return hour, minute
 
 
-def next_weekday(start: date, target_weekday: int) -> date:
-    days_ahead = (target_weekday - start.weekday()) % 7
-    return start + timedelta(days=days_ahead)
-
-
-def combine_datetime(base_date: date, clock: time, tzinfo) -> datetime:
-    return datetime.combine(base_date, clock, tzinfo=tzinfo)
+def _fmt(day: date, hour: int, minute: int) -> str:
+    return f"{day.year:04d}{day.month:02d}{day.day:02d}T{hour:02d}{minute:02d}00"
 
 
+@lru_cache(maxsize=1)
 def ensure_timezone():
     try:
         from zoneinfo import ZoneInfo  # type: ignore
@@ -164,40 +361,25 @@ def ensure_timezone():
 
 
 def build_ics(events, calendar_name="CZQ Weekend Training"):
-    now_stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    lines = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        "PRODID:-//CodexAgent//CZQ Weekend//EN",
-        f"NAME:{calendar_name}",
-        f"X-WR-CALNAME:{calendar_name}",
-        "CALSCALE:GREGORIAN",
-        "X-WR-TIMEZONE:Asia/Shanghai",
-        "BEGIN:VTIMEZONE",
-        "TZID:Asia/Shanghai",
-        "X-LIC-LOCATION:Asia/Shanghai",
-        "BEGIN:STANDARD",
-        "TZOFFSETFROM:+0800",
-        "TZOFFSETTO:+0800",
-        "TZNAME:CST",
-        "DTSTART:19700101T000000",
-        "END:STANDARD",
-        "END:VTIMEZONE",
-    ]
-    for event in events:
-        lines.extend([
-            "BEGIN:VEVENT",
-            f"UID:{event['uid']}",
-            f"DTSTAMP:{now_stamp}",
-            f"SUMMARY:{event['summary']}",
-            f"DTSTART;TZID=Asia/Shanghai:{event['start']}",
-            f"DTEND;TZID=Asia/Shanghai:{event['end']}",
-            "RRULE:FREQ=WEEKLY",
-            f"DESCRIPTION:Source {PRIMARY_URL}",
-            "END:VEVENT",
-        ])
-    lines.append("END:VCALENDAR")
-    return "\n".join(lines) + "\n"
+    t = time.gmtime()
+    now_stamp = (
+        f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}"
+        f"T{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}Z"
+    )
+    parts = [_VCAL_HEAD.format(name=calendar_name)]
+    parts.extend(
+        _VEVENT_TMPL.format(
+            uid=event.uid,
+            stamp=now_stamp,
+            summary=event.summary,
+            start=event.start,
+            end=event.end,
+            url=PRIMARY_URL,
+        )
+        for event in events
+    )
+    parts.append("END:VCALENDAR\r\n")
+    return "\r\n".join(parts)
 
 def main(output_path: str = "weekend_schedule.ics"):
     content, source_label = fetch_content()
@@ -209,28 +391,28 @@ def main(output_path: str = "weekend_schedule.ics"):
         raise SystemExit("Failed to parse all weekend slots. The page layout may have changed.")
 
     today = now.date()
+    base_weekday = today.weekday()
     events = []
 
     for day_cn, (day_en, weekday_index) in DAY_CONFIG.items():
         start_clock, end_clock = time_map[day_cn]
-        start_time = parse_clock(start_clock)
-        end_time = parse_clock(end_clock)
-        event_date = next_weekday(today, weekday_index)
-        start_dt = combine_datetime(event_date, start_time, tzinfo)
-        end_dt = combine_datetime(event_date, end_time, tzinfo)
-        if end_dt <= start_dt:
-            end_dt += timedelta(days=1)
+        start_hm = parse_clock(start_clock)
+        end_hm = parse_clock(end_clock)
+        event_date = today + timedelta(days=(weekday_index - base_weekday) % 7)
+        # Asia/Shanghai has no DST, so wall-clock tuples compare directly.
+        end_date = event_date + timedelta(days=1) if end_hm <= start_hm else event_date
+        start_stamp = _fmt(event_date, *start_hm)
         events.append(
-            {
-                "uid": f"{day_en.lower()}-{start_dt.strftime('%Y%m%dT%H%M%S')}@czq.rth1.xyz",
-                "summary": f"{day_cn} Training",
-                "start": start_dt.strftime("%Y%m%dT%H%M%S"),
-                "end": end_dt.strftime("%Y%m%dT%H%M%S"),
-            }
+            Event(
+                uid=f"{day_en.lower()}-{start_stamp}@czq.rth1.xyz",
+                summary=f"{day_cn} Training",
+                start=start_stamp,
+                end=_fmt(end_date, *end_hm),
+            )
         )
 
     ics_text = build_ics(events)
-    Path(output_path).write_text(ics_text, encoding="utf-8")
+    Path(output_path).write_bytes(ics_text.encode("utf-8"))
     print(f"Generated {output_path} using {source_label} data")
 
 